@@ -0,0 +1,13 @@
+import importlib
+
+import pytest
+import streamlit as st
+
+
+@pytest.fixture(scope="session")
+def app():
+    # The script renders its UI on import; without a secrets.toml st.secrets.get raises
+    mp = pytest.MonkeyPatch()
+    mp.setattr(st, "secrets", {})
+    yield importlib.import_module("streamlit_app")
+    mp.undo()
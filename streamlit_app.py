@@ -1,135 +1,395 @@
 # streamlit_app.py
 # Simple accumulator: read from row 5, keep columns A–J, no date/key filtering
 
-import json
+import hashlib
+import random
 import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
-from typing import List
+from typing import Dict, List
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
-import gspread
 from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
 
 try:
     from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
 except Exception:
     build = None
+    HttpError = None
+
+try:
+    import orjson as _json
+except Exception:
+    import json as _json
+
+# Upper bound on concurrent source reads; each read is one HTTPS round-trip.
+MAX_FETCH_WORKERS = 16
+# Drive accepts at most 100 calls in one batch HTTP request.
+DRIVE_BATCH_LIMIT = 100
+
+# Retries for rate-limited (429, or 403 with a rate-limit reason) and 5xx responses;
+# googleapiclient backs off exponentially.
+API_RETRIES = 5
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+# Rows per values.update when writing the result; keeps request bodies well under the API limit.
+WRITE_CHUNK_ROWS = 5000
+
+# Header sits on row 4 or 5 and only A..J is kept, so nothing outside this range is fetched.
+SOURCE_RANGE = "A4:J"
+
+_SHEET_URL_RE = re.compile(r"https?://docs\.google\.com/spreadsheets/d/([a-zA-Z0-9\-_]+)")
+_SHEET_ID_RE = re.compile(r"/spreadsheets/d/([a-zA-Z0-9\-_]+)")
+_FOLDER_RE = re.compile(r"/folders/([^/?#]*)")
 
 
 # ----------------- HELPERS -----------------
-def get_gc_and_creds(sa_json_text: str):
+@st.cache_resource(show_spinner=False)
+def _load_creds(sa_hash: str, _sa_json_text: str):
+    # Cached across reruns; keyed on the JSON hash so the raw key is never hashed by Streamlit
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
     ]
-    info = json.loads(sa_json_text)
-    creds = Credentials.from_service_account_info(info, scopes=scopes)
-    gc = gspread.authorize(creds)
-    return gc, creds
+    info = _json.loads(_sa_json_text)
+    return Credentials.from_service_account_info(info, scopes=scopes)
+
+
+def sa_fingerprint(sa_json_text: str) -> str:
+    return hashlib.sha256(sa_json_text.encode("utf-8")).hexdigest()
+
+
+def get_creds(sa_json_text: str):
+    return _load_creds(sa_fingerprint(sa_json_text), sa_json_text)
+
+
+_thread_state = threading.local()
 
 
-def open_ws_by_url(gc, url: str, tab: str):
-    sh = gc.open_by_url(url)
-    ws = sh.worksheet(tab)
-    return sh, ws
+def _thread_service(api: str, version: str, creds):
+    # httplib2 connections are not thread-safe, so each thread keeps its own client.
+    # That covers pool workers and the script threads of concurrent sessions, which
+    # share one creds object when they use st.secrets["SA_JSON"].
+    cached = getattr(_thread_state, api, None)
+    if cached is None or cached[0] is not creds:
+        cached = (creds, build(api, version, credentials=creds, cache_discovery=False))
+        setattr(_thread_state, api, cached)
+    return cached[1]
 
 
-def _make_unique_headers(headers: list[str]) -> list[str]:
-    # Replace blanks and make headers unique
-    cleaned = [h.strip() if str(h).strip() else f"Col{i+1}" for i, h in enumerate(headers)]
-    seen = {}
+def get_drive_service(creds):
+    return _thread_service("drive", "v3", creds)
+
+
+def get_sheets_service(creds):
+    return _thread_service("sheets", "v4", creds)
+
+
+@st.cache_resource(show_spinner=False)
+def get_fetch_pool(sa_hash: str) -> ThreadPoolExecutor:
+    """Read pool for one service account. Long-lived workers keep their thread-local
+    Sheets clients, and so their keep-alive HTTPS connections, from one run to the next.
+    Sessions on the same key share its workers, so one large folder queues the others'
+    reads; they draw on the same per-user Sheets quota either way.
+    """
+    return ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="sheets-fetch")
+
+
+def a1_range(tab: str, cells: str) -> str:
+    # Quote the tab name so spaces and punctuation survive A1 parsing
+    return "'" + tab.replace("'", "''") + "'!" + cells
+
+
+def fetch_tab_values(sheets, spreadsheet_id: str, tab: str) -> list[list]:
+    """Fetch SOURCE_RANGE of one tab with a single values.batchGet request.
+    Numbers come back as native JSON numbers; dates keep their sheet formatting.
+    """
+    resp = sheets.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=[a1_range(tab, SOURCE_RANGE)],
+        valueRenderOption="UNFORMATTED_VALUE",
+        dateTimeRenderOption="FORMATTED_STRING",
+    ).execute(num_retries=API_RETRIES)
+    value_ranges = resp.get("valueRanges", [])
+    if not value_ranges:
+        return []
+    return value_ranges[0].get("values", [])
+
+
+def _make_unique_headers(headers: list) -> list[str]:
+    # Replace blanks and make headers unique; suffixes skip names already taken (A, A, A_1 -> A, A_1, A_1_1)
+    counts = Counter()
+    taken = set()
     out = []
-    for h in cleaned:
-        if h in seen:
-            seen[h] += 1
-            out.append(f"{h}_{seen[h]}")
-        else:
-            seen[h] = 0
-            out.append(h)
+    for i, h in enumerate(headers):
+        base = str(h).strip() or f"Col{i+1}"
+        n = counts[base]
+        name = base if n == 0 else f"{base}_{n}"
+        while name in taken:
+            n += 1
+            name = f"{base}_{n}"
+        counts[base] = n + 1
+        taken.add(name)
+        out.append(name)
     return out
 
-def read_df(ws) -> pd.DataFrame:
-    """Read a sheet whose table header may be on row 4 or row 5 (1-based).
-    - Uses the row with more non-empty header cells as the header row.
-    - Keeps only columns A..J (first 10).
+def build_columns_from_values(all_values: list[list]) -> dict[str, list]:
+    """Build {header: column values} from SOURCE_RANGE values (A4:J, so row 4 is index 0).
+    - The table header may be on row 4 or row 5; uses the one with more non-empty cells.
     - Ensures headers are non-empty and unique.
     """
-    all_values = ws.get_all_values()
     if not all_values:
-        return pd.DataFrame()
-
-    # Trim to first 10 columns (A..J)
-    trimmed = [row[:10] for row in all_values]
+        return {}
 
-    # Candidate header rows: row 4 (index 3) or row 5 (index 4)
-    cand_idxs = []
-    if len(trimmed) > 3:
-        cand_idxs.append(3)
-    if len(trimmed) > 4:
-        cand_idxs.append(4)
-    if not cand_idxs:
-        return pd.DataFrame()
+    # Candidate header rows: row 4 (index 0) or row 5 (index 1)
+    cand_idxs = [0]
+    if len(all_values) > 1:
+        cand_idxs.append(1)
 
     def nonempty_count(row):
         return sum(1 for c in row if str(c).strip() != "")
 
     # Choose the row with more non-empty header cells
-    header_idx = max(cand_idxs, key=lambda i: nonempty_count(trimmed[i]))
+    header_idx = max(cand_idxs, key=lambda i: nonempty_count(all_values[i]))
 
-    headers = _make_unique_headers(trimmed[header_idx])
+    # The API drops trailing empty cells, so a short header row must not hide data
+    # further right; pad it to the widest row (at most A..J) and name the extras ColN
+    header_row = all_values[header_idx]
+    width = max(len(r) for r in all_values)
+    headers = _make_unique_headers(header_row + [""] * (width - len(header_row)))
 
     # Data begins the next row
-    data_rows = trimmed[header_idx + 1:]
+    data_rows = all_values[header_idx + 1:]
 
     # Pad rows to match header length (in case some rows are short)
-    width = len(headers)
     padded = [row + [""] * (width - len(row)) if len(row) < width else row[:width] for row in data_rows]
 
-    df = pd.DataFrame(padded, columns=headers)
-
     # Optional: drop rows that are completely empty
-    df = df.loc[(df.astype(str).apply(lambda x: "".join(x).strip(), axis=1) != "")]
-    return df
+    rows = [row for row in padded if "".join(map(str, row)).strip() != ""]
 
+    # Transpose rows into columns
+    columns = list(zip(*rows)) if rows else [()] * width
+    return dict(zip(headers, columns))
 
-def write_to_dest(gc, dest_sheet_url: str, dest_tab: str, df: pd.DataFrame):
-    sh = gc.open_by_url(dest_sheet_url)
-    try:
-        ws = sh.worksheet(dest_tab)
-        ws.clear()
-    except gspread.exceptions.WorksheetNotFound:
-        rows = max(len(df) + 5, 100)
-        cols = max(len(df.columns) + 2, 26)
-        ws = sh.add_worksheet(title=dest_tab, rows=rows, cols=cols)
-    set_with_dataframe(ws, df, include_index=False, include_column_header=True)
+
+def combine_columns(parts: list[dict[str, list]]) -> pd.DataFrame:
+    """Concatenate per-sheet column dicts into one DataFrame in a single pass.
+    Columns are the ordered union across sheets; a sheet lacking a column
+    contributes NaN for it, as pd.concat would.
+    """
+    columns = list(dict.fromkeys(c for part in parts for c in part))
+    lengths = [len(next(iter(part.values()), ())) for part in parts]
+    data = {
+        c: np.concatenate([
+            np.asarray(part[c], dtype=object) if c in part else np.full(n, np.nan, dtype=object)
+            for part, n in zip(parts, lengths)
+        ])
+        for c in columns
+    }
+    # Left as object: frame_to_rows turns every chunk back into Python objects anyway,
+    # so only the preview (preview_table) is converted to Arrow dtypes
+    return pd.DataFrame(data, copy=False)
+
+
+def iter_folder_spreadsheets(drive, folder_id: str):
+    """Yield every spreadsheet in a Drive folder once, following nextPageToken across pages.
+    A folder edited mid-listing can repeat a file on a later page, so ids are de-duplicated.
+    Folders on shared drives are listed too.
+    """
+    seen = set()
+    request = drive.files().list(
+        q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
+        fields="nextPageToken, files(id, name, modifiedTime)", pageSize=1000,
+        supportsAllDrives=True, includeItemsFromAllDrives=True,
+    )
+    while request is not None:
+        resp = request.execute(num_retries=API_RETRIES)
+        for f in resp.get("files", []):
+            if f["id"] not in seen:
+                seen.add(f["id"])
+                yield f
+        request = drive.files().list_next(request, resp)
+
+
+def read_source(spreadsheet_id: str, tab: str, creds) -> dict[str, list]:
+    values = fetch_tab_values(get_sheets_service(creds), spreadsheet_id, tab)
+    return build_columns_from_values(values)
+
+
+def is_retryable(exc: Exception) -> bool:
+    # Mirrors what googleapiclient's num_retries retries: 429, 5xx, rate-limit 403s
+    # and dropped connections
+    if isinstance(exc, OSError):
+        return True
+    if HttpError is None or not isinstance(exc, HttpError):
+        return False
+    status = exc.resp.status
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        details = exc.error_details if isinstance(exc.error_details, list) else []
+        return any(isinstance(d, dict) and d.get("reason") in RATE_LIMIT_REASONS for d in details)
+    return False
+
+
+def fetch_modified_times(drive, file_ids: list[str]) -> dict[str, str]:
+    """Look up Drive modifiedTime for many files, batching up to 100 lookups per HTTP request.
+    Rate-limited or 5xx lookups, and whole batches that fail that way, are retried
+    with exponential backoff. Files whose lookup still fails are left out, so the
+    caller can read them uncached.
+    """
+    times, retry = {}, []
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            times[request_id] = response["modifiedTime"]
+        elif is_retryable(exception):
+            retry.append(request_id)
+
+    pending = list(dict.fromkeys(file_ids))
+    for attempt in range(API_RETRIES + 1):
+        if attempt:
+            time.sleep(min(2 ** attempt + random.random(), 32))
+        retry.clear()
+        for start in range(0, len(pending), DRIVE_BATCH_LIMIT):
+            chunk = pending[start:start + DRIVE_BATCH_LIMIT]
+            batch = drive.new_batch_http_request(callback=collect)
+            for fid in chunk:
+                batch.add(
+                    drive.files().get(fileId=fid, fields="modifiedTime", supportsAllDrives=True),
+                    request_id=fid,
+                )
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch request itself failed, so none of its callbacks ran
+                if is_retryable(e):
+                    retry.extend(chunk)
+        if not retry:
+            break
+        pending = list(retry)
+    return times
+
+
+@st.cache_data(show_spinner=False, ttl=600)
+def fetch_cached(spreadsheet_id: str, tab: str, modified_time: str, sa_hash: str, _creds) -> dict[str, list]:
+    """Read one source tab. modified_time is part of the cache key, so a sheet is
+    only downloaded again after it changes in Drive; sa_hash keeps one service
+    account from being served another's reads. There is no max_entries: the cache
+    is LRU, so any cap below a folder's size would evict every entry before the
+    next run reached it. ttl bounds it to what was read in the last 10 minutes.
+    """
+    return read_source(spreadsheet_id, tab, _creds)
+
+
+def preview_table(df: pd.DataFrame, n: int = 50) -> pa.Table:
+    """First n rows as an Arrow table for st.dataframe.
+    Arrow cannot hold mixed text/number columns, so those are shown as text.
+    """
+    head = df.head(n).convert_dtypes(dtype_backend="pyarrow")
+    mixed = head.select_dtypes(include="object").columns
+    head = head.astype({c: "string[pyarrow]" for c in mixed})
+    return pa.Table.from_pandas(head, preserve_index=False)
+
+
+def frame_to_rows(df: pd.DataFrame) -> list[list]:
+    # JSON-ready rows; blanks for missing cells
+    return df.astype(object).where(df.notna(), "").values.tolist()
 
 
-def ensure_destination_sheet(gc, creds, dest_sheet_url: str, fallback_name: str = "Accumulated Report") -> str:
+def write_to_dest(creds, dest_sheet_url: str, dest_tab: str, df: pd.DataFrame):
+    sheets = get_sheets_service(creds)
+    sid = spreadsheet_id_from_url(dest_sheet_url)
+    needed_rows, needed_cols = len(df) + 1, len(df.columns)
+
+    meta = sheets.spreadsheets().get(
+        spreadsheetId=sid, fields="sheets.properties(sheetId,title,gridProperties)"
+    ).execute(num_retries=API_RETRIES)
+    props = next(
+        (s["properties"] for s in meta.get("sheets", []) if s["properties"]["title"] == dest_tab), None
+    )
+    if props is None:
+        rows = max(len(df) + 5, 100)
+        cols = max(len(df.columns) + 2, 26)
+        requests = [{"addSheet": {"properties": {
+            "title": dest_tab, "gridProperties": {"rowCount": rows, "columnCount": cols},
+        }}}]
+    else:
+        # Clear old values (formatting is kept) and, since values.update does not
+        # grow the grid, make room for the result in the same batchUpdate
+        grid = props.get("gridProperties", {})
+        row_count, col_count = grid.get("rowCount", 0), grid.get("columnCount", 0)
+        requests = [{"updateCells": {"range": {"sheetId": props["sheetId"]}, "fields": "userEnteredValue"}}]
+        if row_count < needed_rows or col_count < needed_cols:
+            requests.append({"updateSheetProperties": {
+                "properties": {"sheetId": props["sheetId"], "gridProperties": {
+                    "rowCount": max(row_count, needed_rows), "columnCount": max(col_count, needed_cols),
+                }},
+                "fields": "gridProperties(rowCount,columnCount)",
+            }})
+    # Not retried when it adds the tab: a retry after a lost response would fail
+    # with "already exists" (same reasoning as files.create below)
+    sheets.spreadsheets().batchUpdate(
+        spreadsheetId=sid, body={"requests": requests}
+    ).execute(num_retries=0 if props is None else API_RETRIES)
+
+    # Header plus the first chunk, then one values.update per WRITE_CHUNK_ROWS rows,
+    # so no single request body (or its JSON) has to hold the whole frame.
+    # USER_ENTERED (as set_with_dataframe used) turns date text read with
+    # FORMATTED_STRING back into real dates; numbers are sent as numbers either way.
+    values_api = sheets.spreadsheets().values()
+    first = [list(df.columns)] + frame_to_rows(df.iloc[:WRITE_CHUNK_ROWS])
+    values_api.update(
+        spreadsheetId=sid, range=a1_range(dest_tab, "A1"), valueInputOption="USER_ENTERED", body={"values": first}
+    ).execute(num_retries=API_RETRIES)
+    for start in range(WRITE_CHUNK_ROWS, len(df), WRITE_CHUNK_ROWS):
+        rows = frame_to_rows(df.iloc[start:start + WRITE_CHUNK_ROWS])
+        values_api.update(
+            spreadsheetId=sid,
+            range=a1_range(dest_tab, f"A{start + 2}"),
+            valueInputOption="USER_ENTERED",
+            body={"values": rows},
+        ).execute(num_retries=API_RETRIES)
+
+
+def ensure_destination_sheet(creds, dest_sheet_url: str, fallback_name: str = "Accumulated Report") -> str:
     if dest_sheet_url:
         return dest_sheet_url
     if build is None:
         raise RuntimeError("google-api-python-client not installed.")
-    drive = build("drive", "v3", credentials=creds)
+    drive = get_drive_service(creds)
     file = drive.files().create(
         body={"name": fallback_name, "mimeType": "application/vnd.google-apps.spreadsheet"},
         fields="id, webViewLink"
-    ).execute()
+    ).execute()  # not retried: a retry after a lost response would create a second file
     return f"https://docs.google.com/spreadsheets/d/{file['id']}/edit"
 
 
 def normalize_folder_id(s: str) -> str:
     if not s:
         return ""
-    if "/folders/" in s:
-        return s.split("/folders/")[1].split("/")[0].split("?")[0]
-    return s
+    m = _FOLDER_RE.search(s)
+    return m.group(1) if m else s
+
+
+def spreadsheet_id_from_url(u: str) -> str:
+    m = _SHEET_ID_RE.search(u)
+    if not m:
+        raise ValueError(f"Not a Google Sheets URL: {u}")
+    return m.group(1)
 
 
 def normalize_sheet_url(u: str) -> str:
     u = (u or "").strip()
-    m = re.search(r"https?://docs\.google\.com/spreadsheets/d/([a-zA-Z0-9\-_]+)", u)
+    m = _SHEET_URL_RE.search(u)
     if not m:
         raise ValueError(f"Not a Google Sheets URL: {u}")
     return f"https://docs.google.com/spreadsheets/d/{m.group(1)}/edit"
@@ -185,43 +445,46 @@ if st.button("🚀 Run Accumulation"):
             st.error("Enter a Folder ID or switch mode.")
             st.stop()
 
-        gc, creds = get_gc_and_creds(sa_json_text)
+        if build is None:
+            st.error("google-api-python-client not installed.")
+            st.stop()
+
+        sa_hash = sa_fingerprint(sa_json_text)
+        creds = get_creds(sa_json_text)
 
-        frames: List[pd.DataFrame] = []
+        drive = get_drive_service(creds)
         if src_mode == "List of Sheet URLs":
-            for u in sheet_urls:
-                _, ws = open_ws_by_url(gc, u, source_tab)
-                frames.append(read_df(ws))
+            # The same spreadsheet pasted twice (or via another tab's URL) is read once
+            sheet_ids = list(dict.fromkeys(spreadsheet_id_from_url(u) for u in sheet_urls))
+            modified_times = fetch_modified_times(drive, sheet_ids)
+            sources = [(sid, modified_times.get(sid)) for sid in sheet_ids]
         else:
-            if build is None:
-                st.error("google-api-python-client not installed.")
-                st.stop()
-            drive = build("drive", "v3", credentials=creds)
-            files = drive.files().list(
-                q=f"'{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
-                fields="files(id, name)", pageSize=1000
-            ).execute().get("files", [])
-            if not files:
-                st.error("No spreadsheets found.")
-                st.stop()
-            for f in files:
-                url = f"https://docs.google.com/spreadsheets/d/{f['id']}/edit"
-                _, ws = open_ws_by_url(gc, url, source_tab)
-                frames.append(read_df(ws))
-
-        if not frames:
-            st.error("No data found.")
+            # Lazy, so reads of the first page start while later pages are still listed
+            sources = ((f["id"], f["modifiedTime"]) for f in iter_folder_spreadsheets(drive, folder_id))
+
+        def fetch_columns(source) -> Dict[str, list]:
+            sid, modified_time = source
+            if modified_time is None:
+                # Drive lookup failed; the Sheets read may still work, it just can't be cached
+                return read_source(sid, source_tab, creds)
+            return fetch_cached(sid, source_tab, modified_time, sa_hash, creds)
+
+        # Reads are network-bound, so overlap them; map() keeps the source order.
+        parts: List[Dict[str, list]] = list(get_fetch_pool(sa_hash).map(fetch_columns, sources))
+
+        if not parts:
+            st.error("No spreadsheets found." if src_mode == "Folder ID" else "No data found.")
             st.stop()
 
         # Combine all data
-        result_df = pd.concat(frames, ignore_index=True)
+        result_df = combine_columns(parts)
 
         st.subheader("Preview Result")
-        st.dataframe(result_df.head(50))
+        st.dataframe(preview_table(result_df))
         st.write(f"Rows: {len(result_df)}, Columns: {len(result_df.columns)}")
 
-        dest_sheet_url = ensure_destination_sheet(gc, creds, dest_sheet_url)
-        write_to_dest(gc, dest_sheet_url, dest_tab, result_df)
+        dest_sheet_url = ensure_destination_sheet(creds, dest_sheet_url)
+        write_to_dest(creds, dest_sheet_url, dest_tab, result_df)
         st.success(f"✅ Wrote {len(result_df)} rows to {dest_tab} in {dest_sheet_url}")
 
     except Exception as e:
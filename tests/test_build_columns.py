@@ -0,0 +1,22 @@
+def test_keeps_columns_right_of_a_short_header(app):
+    values = [[], ["Name", "Qty"], ["a", 1, "", "", "", "", "", "", "note", 9]]
+    cols = app.build_columns_from_values(values)
+    assert list(cols) == ["Name", "Qty"] + [f"Col{i}" for i in range(3, 11)]
+    assert cols["Col9"] == ("note",)
+    assert cols["Col10"] == (9,)
+
+
+def test_picks_fuller_header_row_and_drops_blank_rows(app):
+    values = [["A", "B", "", "A"], [1, "x"], [], ["", ""], [2.5, "y", "z"]]
+    cols = app.build_columns_from_values(values)
+    assert cols == {"A": (1, 2.5), "B": ("x", "y"), "Col3": ("", "z"), "A_1": ("", "")}
+
+
+def test_empty_tab(app):
+    assert app.build_columns_from_values([]) == {}
+    assert app.build_columns_from_values([["h"]]) == {"h": ()}
+
+
+def test_unique_headers_skip_names_already_taken(app):
+    assert app._make_unique_headers(["A", "A", "A_1"]) == ["A", "A_1", "A_1_1"]
+    assert app._make_unique_headers([" ", "B", ""]) == ["Col1", "B", "Col3"]
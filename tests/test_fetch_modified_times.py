@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from googleapiclient.errors import HttpError
+
+
+class Resp(dict):
+    def __init__(self, status):
+        super().__init__(status=str(status))
+        self.status = status
+        self.reason = ""
+
+
+def http_error(status, reason=""):
+    body = {"error": {"code": status, "message": reason, "errors": [{"reason": reason}]}}
+    return HttpError(Resp(status), json.dumps(body).encode())
+
+
+class FakeDrive:
+    """Answers batched files.get lookups from a script of per-round outcomes."""
+
+    def __init__(self, batch_errors=(), lookup_errors=None):
+        self.batch_errors = list(batch_errors)
+        self.lookup_errors = lookup_errors or {}
+        self.rounds = []
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields, supportsAllDrives):
+        assert supportsAllDrives
+        return fileId
+
+    def new_batch_http_request(self, callback):
+        drive = self
+
+        class Batch:
+            ids = []
+
+            def add(self, request, request_id):
+                self.ids = self.ids + [request_id]
+
+            def execute(self):
+                drive.rounds.append(self.ids)
+                if drive.batch_errors:
+                    raise drive.batch_errors.pop(0)
+                for fid in self.ids:
+                    errors = drive.lookup_errors.get(fid, [])
+                    if errors:
+                        callback(fid, None, errors.pop(0))
+                    else:
+                        callback(fid, {"modifiedTime": "t-" + fid}, None)
+
+        return Batch()
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(app, monkeypatch):
+    monkeypatch.setattr(app.time, "sleep", lambda s: None)
+
+
+def test_retries_only_rate_limited_and_5xx_lookups(app):
+    drive = FakeDrive(lookup_errors={
+        "a": [http_error(429)],
+        "b": [http_error(403, "userRateLimitExceeded")],
+        "c": [http_error(403, "forbidden")],
+        "d": [http_error(503)],
+    })
+    times = app.fetch_modified_times(drive, ["a", "b", "c", "d", "e", "a"])
+    assert times == {"a": "t-a", "b": "t-b", "d": "t-d", "e": "t-e"}
+    assert drive.rounds == [["a", "b", "c", "d", "e"], ["a", "b", "d"]]
+
+
+def test_retries_a_failed_batch_request(app):
+    drive = FakeDrive(batch_errors=[http_error(503)])
+    assert app.fetch_modified_times(drive, ["a", "b"]) == {"a": "t-a", "b": "t-b"}
+    assert drive.rounds == [["a", "b"], ["a", "b"]]
+
+
+def test_gives_up_without_raising(app):
+    drive = FakeDrive(batch_errors=[http_error(503)] * (app.API_RETRIES + 1))
+    assert app.fetch_modified_times(drive, ["a"]) == {}
+    assert len(drive.rounds) == app.API_RETRIES + 1
+
+    drive = FakeDrive(batch_errors=[http_error(400, "badRequest")])
+    assert app.fetch_modified_times(drive, ["a"]) == {}
+    assert len(drive.rounds) == 1
+
+
+def test_splits_lookups_into_batches_of_100(app):
+    drive = FakeDrive()
+    ids = [f"f{i}" for i in range(250)]
+    assert len(app.fetch_modified_times(drive, ids)) == 250
+    assert [len(r) for r in drive.rounds] == [100, 100, 50]
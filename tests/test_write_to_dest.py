@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+
+class FakeSheets:
+    """Records the calls write_to_dest makes against one spreadsheet."""
+
+    def __init__(self, tabs):
+        self.tabs = tabs
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, fields):
+        sheets = [{"properties": {"sheetId": i, "title": t, "gridProperties": g}}
+                  for i, (t, g) in enumerate(self.tabs.items())]
+        return self._call("get", {"sheets": sheets})
+
+    def batchUpdate(self, spreadsheetId, body):
+        return self._call("batchUpdate", body["requests"])
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return self._call("update", (range, valueInputOption, body["values"]))
+
+    def _call(self, name, payload):
+        calls = self.calls
+
+        class Request:
+            def execute(self, num_retries=0):
+                calls.append((name, payload, num_retries))
+                return payload if name == "get" else {}
+
+        return Request()
+
+
+URL = "https://docs.google.com/spreadsheets/d/DEST/edit"
+
+
+@pytest.fixture
+def sheets(app, monkeypatch):
+    fake = FakeSheets({"Out": {"rowCount": 3, "columnCount": 26}})
+    monkeypatch.setattr(app, "get_sheets_service", lambda creds: fake)
+    monkeypatch.setattr(app, "WRITE_CHUNK_ROWS", 2)
+    return fake
+
+
+def test_chunks_start_below_the_header(app, sheets):
+    df = pd.DataFrame({"n": [1, 2, 3, 4, 5], "s": ["a", None, "c", "d", "1/2/2024"]})
+    app.write_to_dest(None, URL, "Out", df)
+
+    updates = [payload for name, payload, _ in sheets.calls if name == "update"]
+    assert [r for r, _, _ in updates] == ["'Out'!A1", "'Out'!A4", "'Out'!A6"]
+    assert updates[0][2] == [["n", "s"], [1, "a"], [2, ""]]
+    assert updates[1][2] == [[3, "c"], [4, "d"]]
+    assert updates[2][2] == [[5, "1/2/2024"]]
+    assert {opt for _, opt, _ in updates} == {"USER_ENTERED"}
+
+
+def test_clears_and_grows_an_existing_tab(app, sheets):
+    app.write_to_dest(None, URL, "Out", pd.DataFrame({"n": range(5)}))
+
+    name, requests, retries = sheets.calls[1]
+    assert name == "batchUpdate" and retries == app.API_RETRIES
+    assert requests[0] == {"updateCells": {"range": {"sheetId": 0}, "fields": "userEnteredValue"}}
+    grid = requests[1]["updateSheetProperties"]["properties"]["gridProperties"]
+    assert grid == {"rowCount": 6, "columnCount": 26}
+
+
+def test_adding_the_tab_is_not_retried(app, sheets):
+    app.write_to_dest(None, URL, "New", pd.DataFrame({"n": [1]}))
+
+    name, requests, retries = sheets.calls[1]
+    assert name == "batchUpdate" and retries == 0
+    assert requests[0]["addSheet"]["properties"]["title"] == "New"